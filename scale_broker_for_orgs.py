@@ -3,79 +3,357 @@ import json
 import argparse
 import sys
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+from functools import partial
 
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 
-# Validate and sanitize input file paths 
-def sanitize_input_path(user_path, base_dir=None):
-    if base_dir is None:
-        base_dir = os.getcwd()
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+from snyk_orgs.client import (
+    LOG_EXTENSIONS,
+    REQUEST_TIMEOUT,
+    RETRY_STATUSES,
+    SNYK_API_URL,
+    create_session,
+    dumps_json,
+    get_api_token,
+    loads_json,
+    retry_backoff,
+    sanitize_input_path,
+    sanitize_output_path,
+)
+from snyk_orgs.ratelimit import AdaptiveRateLimiter
+
+
+# Arrays that may hold organizations: {"organizations": {"orgs": [...]}}, {"orgs": [...]} or [...]
+_ORGS_ARRAY_PREFIXES = ('organizations.orgs', 'orgs', '')
+
+_IJSON_ERRORS = (ijson.JSONError,) if ijson is not None else ()
+
+# Input files smaller than this are parsed in one go; ijson's per-event overhead outweighs the memory saved
+STREAMING_PARSE_THRESHOLD = 1 << 20
+
+# Results buffered between explicit flush + fsync checkpoints of the connection log
+LOG_SYNC_INTERVAL = 100
+
+# Orgs between progress lines when stderr is not a terminal
+PROGRESS_LINE_INTERVAL = 50
+
+_timestamp_cache = (0, "")
+
+
+# ISO timestamp for per-org log entries at one-second resolution, formatted once per second
+def now_iso():
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, cached = _timestamp_cache
+    if second != cached_second:
+        cached = datetime.fromtimestamp(second).isoformat()
+        _timestamp_cache = (second, cached)
+    return cached
+
+
+# Push buffered log lines to the OS and on to disk
+def sync_log(log_file):
+    log_file.flush()
+    os.fsync(log_file.fileno())
+
+
+class _StderrProgress:
+    """Fallback for tqdm: one status line on stderr, redrawn at most every ``mininterval`` seconds.
+
+    With ``line_every`` set (used when stderr is not a terminal) it instead writes a
+    full line every ``line_every`` orgs, so CI logs and redirected output stay readable.
+    """
+
+    def __init__(self, mininterval=0.5, line_every=None):
+        self.n = 0
+        self.mininterval = mininterval
+        self.line_every = line_every
+        self._postfix = ""
+        self._last_draw = 0.0
+
+    def set_postfix(self, refresh=True, **kwargs):
+        self._postfix = ", ".join(f"{key}={value}" for key, value in kwargs.items())
+
+    def update(self, n=1):
+        previous = self.n
+        self.n += n
+        if self.line_every:
+            if self.n // self.line_every > previous // self.line_every:
+                self._write_line()
+            return
+        now = time.monotonic()
+        if now - self._last_draw >= self.mininterval:
+            self._last_draw = now
+            self._draw()
+
+    def close(self):
+        if self.line_every:
+            if self.n % self.line_every:
+                self._write_line()
+            return
+        self._draw()
+        sys.stderr.write("\n")
+
+    def _draw(self):
+        sys.stderr.write(f"\rConnecting: {self.n} orgs [{self._postfix}]")
+        sys.stderr.flush()
+
+    def _write_line(self):
+        sys.stderr.write(f"Connecting: {self.n} orgs [{self._postfix}]\n")
+        sys.stderr.flush()
+
+
+# Progress reporter on stderr: tqdm on a terminal when installed, periodic plain lines otherwise
+def create_progress():
+    if not sys.stderr.isatty():
+        return _StderrProgress(line_every=PROGRESS_LINE_INTERVAL)
+    if tqdm is not None:
+        return tqdm(desc="Connecting", unit="org", file=sys.stderr, mininterval=0.5)
+    return _StderrProgress()
+
+
+# Yield organizations from a JSON file without loading the whole document
+def load_organizations_from_json(path):
+    if ijson is None or os.path.getsize(path) < STREAMING_PARSE_THRESHOLD:
+        with open(path, 'rb') as f:
+            data = loads_json(f.read())
+        
+        if 'organizations' in data and 'orgs' in data['organizations']:
+            organizations = data['organizations']['orgs']
+        elif 'orgs' in data:
+            organizations = data['orgs']
+        elif isinstance(data, list):
+            organizations = data
+        else:
+            raise ValueError("Unsupported JSON structure. Expected 'orgs' key or list of organizations.")
+        
+        yield from organizations
+        return
     
-    abs_user_path = os.path.abspath(user_path)
-    abs_base_dir = os.path.abspath(base_dir)
+    # ijson reads bytes and emits (prefix, event, value); rebuild one org object at a time
+    with open(path, 'rb') as f:
+        events = ijson.parse(f, use_float=True)
+        orgs_prefix = None
+        for prefix, event, value in events:
+            if event == 'start_array' and orgs_prefix is None and prefix in _ORGS_ARRAY_PREFIXES:
+                orgs_prefix = f"{prefix}.item" if prefix else "item"
+            elif event == 'start_map' and prefix == orgs_prefix:
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                for prefix, event, value in events:
+                    builder.event(event, value)
+                    if prefix == orgs_prefix and event == 'end_map':
+                        break
+                yield builder.value
     
-    if not abs_user_path.startswith(abs_base_dir):
-        raise ValueError(f"Input path must be within {abs_base_dir}")
+    if orgs_prefix is None:
+        raise ValueError("Unsupported JSON structure. Expected 'orgs' key or list of organizations.")
 
-    if not os.path.exists(abs_user_path):
-        raise FileNotFoundError(f"File not found: {user_path}")
+
+# Connect organization to Universal Broker
+def connect_org_to_broker(session, limiter, url_template, request_body, max_retries, org_id):
+    url = url_template.format(org_id=org_id)
     
-    if not abs_user_path.endswith('.json'):
-        raise ValueError("Input file must be a JSON file")
+    # 429/5xx are retried here rather than in urllib3 so the limiter sees every throttled response
+    for attempt in range(max_retries + 1):
+        # Checked before every attempt, so an aborted run stops retrying
+        if not limiter.acquire():
+            return False, {"error": "Run aborted", "message": f"Request cancelled for organization {org_id}"}
+        response = None
+        try:
+            response = session.post(url, data=request_body, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            return False, {"error": str(e), "message": f"Request failed for organization {org_id}"}
+        finally:
+            # Feed the outcome back so pacing adapts to throttling and Retry-After
+            limiter.release(response)
+        
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            break
+        # The limiter already pauses every worker for Retry-After; otherwise back off with jitter
+        if "Retry-After" not in response.headers:
+            limiter.cancelled.wait(retry_backoff(attempt + 1))
     
-    return abs_user_path
+    if response.status_code in [200, 201]:
+        if not response.content:
+            return True, {"status": "success"}
+        # A non-JSON body fails this org only instead of escaping through future.result()
+        try:
+            return True, response.json()
+        except ValueError as e:
+            return False, {"error": str(e), "message": f"Failed to connect organization {org_id}"}
+    elif response.status_code == 409:
+        return True, {"status": "already_connected", "message": "Organization already connected to broker"}
+    else:
+        return False, {
+            "status_code": response.status_code,
+            "error": response.text,
+            "url": url,
+            "message": f"Failed to connect organization {org_id}"
+        }
 
 
-# Validate and sanitize output file paths
-def sanitize_output_path(user_path, base_dir=None):
-    if base_dir is None:
-        base_dir = os.getcwd()
+# Connect every organization in one JSON file, logging results next to its own summary
+def run_shard(executor, limiter, connect_org, json_path, log_path, tenant_id, args):
+    summary_path = f"{os.path.splitext(log_path)[0]}.summary.json"
     
-    abs_user_path = os.path.abspath(user_path)
-    abs_base_dir = os.path.abspath(base_dir)
+    # Stream organizations from the JSON file; the total is counted as they are processed
+    organizations = load_organizations_from_json(json_path)
     
-    if not abs_user_path.startswith(abs_base_dir):
-        raise ValueError(f"Output path must be within {abs_base_dir}")
+    # Initialize counters and results
+    total_orgs = 0
+    successful_connections = 0
+    failed_connections = 0
+    failed_orgs = []
+    results_written = 0
     
-    if not abs_user_path.endswith(('.json', '.log')):
-        raise ValueError("Output file must have .json or .log extension")
+    print("-" * 60)
+    print(f"Organizations file: {json_path}")
     
-    return abs_user_path
-
-
-# Connect organization to Universal Broker
-def connect_org_to_broker(tenant_id, connection_id, org_id, api_token, integration_id, integration_type):
-    url = f"https://api.snyk.io/rest/tenants/{tenant_id}/brokers/connections/{connection_id}/orgs/{org_id}/integration?version=2024-02-08~experimental"
+    log_file = None
     
-    headers = {
-        "Authorization": f"token {api_token}",
-        "Content-Type": "application/vnd.api+json"
-    }
+    # Append a single result to the log, checkpointing to disk every LOG_SYNC_INTERVAL records
+    def write_result(result):
+        nonlocal log_file, results_written
+        # Opened on the first result so an input without organizations leaves no empty log behind;
+        # results are appended one JSON object per line as they finish, so a crash keeps completed work
+        if log_file is None:
+            log_file = open(log_path, 'ab', buffering=1 << 20)
+        log_file.write(dumps_json(result, newline=True))
+        results_written += 1
+        if results_written % LOG_SYNC_INTERVAL == 0:
+            sync_log(log_file)
     
-    request_body = {
-        "data": {
-            "integration_id": integration_id,
-            "type": integration_type
-        }
-    }
+    # Per-org detail lives in the log; the terminal only gets a throttled progress line
+    progress = create_progress()
     
-    try:
-        response = requests.post(url, headers=headers, json=request_body)
+    # Record the outcome of a finished connection request
+    def record_result(future, index, org_id, org_name):
+        nonlocal successful_connections, failed_connections
+        success, response_data = future.result()
         
-        if response.status_code in [200, 201]:
-            return True, response.json() if response.content else {"status": "success"}
-        elif response.status_code == 409:
-            return True, {"status": "already_connected", "message": "Organization already connected to broker"}
+        result = {
+            "index": index,
+            "org_id": org_id,
+            "org_name": org_name,
+            "success": success,
+            "response": response_data,
+            "timestamp": now_iso()
+        }
+        write_result(result)
+        
+        if success:
+            successful_connections += 1
         else:
-            return False, {
-                "status_code": response.status_code,
-                "error": response.text,
-                "url": url,
-                "message": f"Failed to connect organization {org_id}"
-            }
+            failed_connections += 1
+            error_msg = response_data.get('message', 'Unknown error')
+            failed_orgs.append((org_name, org_id, error_msg))
+        
+        progress.set_postfix(ok=successful_connections, fail=failed_connections, refresh=False)
+        progress.update(1)
+    
+    # Validate orgs as they stream in: record the ones without an ID and yield the rest for the network loop
+    def connectable_orgs():
+        nonlocal total_orgs, failed_connections
+        for org in organizations:
+            total_orgs += 1
+            org_id = org.get('id')
+            org_name = org.get('name', 'Unknown')
+            
+            if org_id:
+                yield total_orgs, org_id, org_name
+                continue
+            
+            failed_connections += 1
+            failed_orgs.append((org_name, None, "Missing organization ID"))
+            write_result({
+                "index": total_orgs,
+                "org_id": None,
+                "org_name": org_name,
+                "success": False,
+                "error": "Missing organization ID",
+                "timestamp": now_iso()
+            })
+            progress.set_postfix(ok=successful_connections, fail=failed_connections, refresh=False)
+            progress.update(1)
+    
+    # Feed a bounded pool; only a small window of requests is queued so input can stay streamed
+    max_pending = args.concurrency * 2
+    pending = {}
+    try:
+        for index, org_id, org_name in connectable_orgs():
+            future = executor.submit(connect_org, org_id)
+            pending[future] = (index, org_id, org_name)
             
-    except requests.exceptions.RequestException as e:
-        return False, {"error": str(e), "message": f"Request failed for organization {org_id}"}
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record_result(future, *pending.pop(future))
+        
+        # Drain whatever is still in flight
+        for future in as_completed(list(pending)):
+            record_result(future, *pending.pop(future))
+    except BaseException:
+        # On abort, drop queued requests and stop retries, but log any that were already sent
+        limiter.cancel()
+        for future in pending:
+            future.cancel()
+        for future in as_completed(list(pending)):
+            if future.cancelled():
+                continue
+            try:
+                record_result(future, *pending[future])
+            except Exception:
+                # Keep logging the others; the original exception is re-raised below
+                pass
+        raise
+    finally:
+        progress.close()
+        if log_file is not None:
+            sync_log(log_file)
+            log_file.close()
+    
+    if total_orgs == 0:
+        print("No organizations found in the JSON file.")
+        return
+    
+    summary = {
+        "total_organizations": total_orgs,
+        "successful_connections": successful_connections,
+        "failed_connections": failed_connections,
+        "tenant_id": tenant_id,
+        "connection_id": args.connection_id,
+        "results_log": log_path,
+        "timestamp": datetime.now().isoformat()
+    }
+    
+    with open(summary_path, 'wb') as f:
+        f.write(dumps_json(summary, indent=True, newline=True))
+    
+    print(f"\nConnection Summary:")
+    print(f"  Total organizations: {total_orgs}")
+    print(f"  Successful connections: {successful_connections}")
+    print(f"  Failed connections: {failed_connections}")
+    print(f"  Success rate: {(successful_connections/total_orgs)*100:.1f}%")
+    print(f"  Log file: {log_path}")
+    print(f"  Summary file: {summary_path}")
+    
+    if failed_connections > 0:
+        print(f"\nFailed organizations:")
+        for org_name, org_id, error_msg in failed_orgs:
+            print(f"  - {org_name} (ID: {org_id}): {error_msg}")
 
 
 def main():
@@ -86,7 +364,8 @@ def main():
     parser.add_argument(
         "--json-file",
         required=True,
-        help="Path to JSON file containing organizations data"
+        action="append",
+        help="Path to JSON file containing organizations data; repeat to process several shards in one run"
     )
 
     parser.add_argument(
@@ -110,145 +389,122 @@ def main():
     parser.add_argument(
         "--output-log",
         default=None,
-        help="Output file to save connection results (default: connection_log_<timestamp>.json)"
+        action="append",
+        help="Output file to append per-organization results to as JSON lines, once per --json-file (default: connection_log_<timestamp>.log)"
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Maximum number of organizations to connect in parallel (default: 10)"
+    )
+
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="Optional cap on requests per second (default: unlimited)"
+    )
+
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries per organization on 429/5xx or connection errors (default: 5)"
     )
     
     args = parser.parse_args()
     
     # Get tenant ID from argument or environment variable
     tenant_id = os.environ.get('SNYK_TENANT_ID')
-    api_token = os.environ.get('SNYK_API_TOKEN')
+    api_token = get_api_token()
     if not tenant_id:
         print("Error: SNYK_TENANT_ID environment variable must be set", file=sys.stderr)
         sys.exit(1)
     if not api_token:
-        print("Error: SNYK_API_TOKEN environment variable must be set", file=sys.stderr)
+        print("Error: SNYK_API_TOKEN (or SNYK_TOKEN) environment variable must be set", file=sys.stderr)
+        sys.exit(1)
+    if args.concurrency < 1:
+        print("Error: --concurrency must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    if args.max_rate is not None and args.max_rate <= 0:
+        print("Error: --max-rate must be greater than 0", file=sys.stderr)
+        sys.exit(1)
+    if args.max_retries < 0:
+        print("Error: --max-retries cannot be negative", file=sys.stderr)
+        sys.exit(1)
+    
+    if args.output_log is not None and len(args.output_log) != len(args.json_file):
+        print("Error: pass --output-log once per --json-file, or not at all", file=sys.stderr)
         sys.exit(1)
     
-    # Generate default log filename if not provided
+    # Generate default log filenames if not provided; several shards get numbered logs
     if args.output_log is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        args.output_log = f"connection_log_{timestamp}.json"
+        if len(args.json_file) == 1:
+            args.output_log = [f"connection_log_{timestamp}.log"]
+        else:
+            args.output_log = [
+                f"connection_log_{timestamp}_{shard}.log" for shard in range(1, len(args.json_file) + 1)
+            ]
     
+    # One pooled session keeps a warm TLS connection to the API for every org in every shard
+    session = create_session(
+        api_token,
+        content_type="application/vnd.api+json",
+        pool_maxsize=args.concurrency,
+        # Safe to retry: re-posting an already connected org returns 409, which counts as success
+        max_retries=args.max_retries,
+        retry_methods=("POST",),
+        # Connection errors only; connect_org_to_broker retries 429/5xx itself so the limiter sees them
+        retry_statuses=()
+    )
+    # Shrinks in-flight requests on 429/5xx and grows them back while the API keeps up
+    limiter = AdaptiveRateLimiter(args.concurrency, max_rate=args.max_rate)
+
     try:
-        # Validate paths early in main function
-        validated_json_path = sanitize_input_path(args.json_file)
-        validated_log_path = sanitize_output_path(args.output_log)
+        # Validate every shard's paths before any request is sent
+        shards = [
+            (sanitize_input_path(json_file), sanitize_output_path(output_log, extensions=LOG_EXTENSIONS))
+            for json_file, output_log in zip(args.json_file, args.output_log)
+        ]
         
-        # Load organizations from JSON file
-        with open(validated_json_path, 'r') as f:
-            data = json.load(f)
-        
-        if 'organizations' in data and 'orgs' in data['organizations']:
-            organizations = data['organizations']['orgs']
-        elif 'orgs' in data:
-            organizations = data['orgs']
-        elif isinstance(data, list):
-            organizations = data
-        else:
-            raise ValueError("Unsupported JSON structure. Expected 'orgs' key or list of organizations.")
-        
-        if not organizations:
-            print("No organizations found in the JSON file.")
-            return
-        
-        print(f"Loaded {len(organizations)} organizations")
-        
-        # Initialize counters and results
-        total_orgs = len(organizations)
-        successful_connections = 0
-        failed_connections = 0
-        results = []
+        # The endpoint and body only vary by org ID, so build them once per run
+        url_template = (
+            f"{SNYK_API_URL}/rest/tenants/{tenant_id}/brokers/connections/{args.connection_id}"
+            "/orgs/{org_id}/integration?version=2024-02-08~experimental"
+        )
+        # Serialized once; the session already sends the JSON:API Content-Type
+        request_body = dumps_json({
+            "data": {
+                "integration_id": args.integration_id,
+                "type": args.integration_type
+            }
+        })
+        # Everything but the org ID is fixed for the run, so bind it once
+        connect_org = partial(
+            connect_org_to_broker, session, limiter, url_template, request_body, args.max_retries
+        )
         
         print(f"Starting connection process...")
         print(f"Tenant ID: {tenant_id}")
         print(f"Connection ID: {args.connection_id}")
-        print("-" * 60)
-        
-        # Process each organization
-        for i, org in enumerate(organizations, 1):
-            org_id = org.get('id')
-            org_name = org.get('name', 'Unknown')
-            
-            if not org_id:
-                print(f"[{i}/{total_orgs}] Skipping organization (missing ID): {org_name}")
-                failed_connections += 1
-                results.append({
-                    "org_id": None,
-                    "org_name": org_name,
-                    "success": False,
-                    "error": "Missing organization ID",
-                    "timestamp": datetime.now().isoformat()
-                })
-                continue
-            
-            print(f"[{i}/{total_orgs}] Connecting {org_name} (ID: {org_id})...")
-            
-            success, response_data = connect_org_to_broker(
-                tenant_id, 
-                args.connection_id, 
-                org_id, 
-                api_token,
-                args.integration_id,
-                args.integration_type
-            )
-            
-            # Record result
-            result = {
-                "org_id": org_id,
-                "org_name": org_name,
-                "success": success,
-                "response": response_data,
-                "timestamp": datetime.now().isoformat()
-            }
-            results.append(result)
-            
-            if success:
-                successful_connections += 1
-                status = response_data.get('status', 'connected')
-                print(f"  ✅ Success - {status}")
-            else:
-                failed_connections += 1
-                error_msg = response_data.get('message', 'Unknown error')
-                print(f"  ❌ Failed - {error_msg}")
-        
-        log_data = {
-            "summary": {
-                "total_organizations": total_orgs,
-                "successful_connections": successful_connections,
-                "failed_connections": failed_connections,
-                "tenant_id": tenant_id,
-                "connection_id": args.connection_id,
-                "timestamp": datetime.now().isoformat()
-            },
-            "results": results
-        }
-        
-        with open(validated_log_path, 'w') as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
-        
-        print("-" * 60)
-        print(f"\nConnection Summary:")
-        print(f"  Total organizations: {total_orgs}")
-        print(f"  Successful connections: {successful_connections}")
-        print(f"  Failed connections: {failed_connections}")
-        print(f"  Success rate: {(successful_connections/total_orgs)*100:.1f}%")
-        print(f"  Log file: {validated_log_path}")
         
-        if failed_connections > 0:
-            print(f"\nFailed organizations:")
-            for result in results:
-                if not result['success']:
-                    error_msg = result['response'].get('message', 'Unknown error')
-                    print(f"  - {result['org_name']} (ID: {result['org_id']}): {error_msg}")
+        # Shards run one after another through the same pool, session and rate limiter
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for json_path, log_path in shards:
+                run_shard(executor, limiter, connect_org, json_path, log_path, tenant_id, args)
         
-    except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+    except (FileNotFoundError, json.JSONDecodeError, ValueError, *_IJSON_ERRORS) as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
     except KeyboardInterrupt:
         print("\nOperation cancelled by user.", file=sys.stderr)
         sys.exit(1)
+    finally:
+        session.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
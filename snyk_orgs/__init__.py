@@ -0,0 +1,25 @@
+"""Shared Snyk API helpers used by the org automation scripts."""
+
+from snyk_orgs.client import (
+    create_session,
+    dumps_json,
+    get_api_token,
+    iter_snyk_organizations,
+    loads_json,
+    sanitize_input_path,
+    sanitize_output_path,
+    save_to_json,
+)
+from snyk_orgs.ratelimit import AdaptiveRateLimiter
+
+__all__ = [
+    "AdaptiveRateLimiter",
+    "create_session",
+    "dumps_json",
+    "get_api_token",
+    "iter_snyk_organizations",
+    "loads_json",
+    "sanitize_input_path",
+    "sanitize_output_path",
+    "save_to_json",
+]
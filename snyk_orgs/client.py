@@ -0,0 +1,317 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+import json
+import logging
+import os
+import math
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+SNYK_API_URL = "https://api.snyk.io"
+REST_API_VERSION = "2024-10-15"
+REST_PAGE_LIMIT = 100
+
+PAGE_FETCH_WORKERS = 8
+
+# (connect, read) seconds: fail fast on an unreachable host, but allow slow responses
+REQUEST_TIMEOUT = (5, 30)
+
+# Transient statuses worth retrying; Retry-After is honoured on these
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF_FACTOR = 0.5
+# urllib3's own default cap on a single backoff
+RETRY_BACKOFF_MAX = 120
+
+JSON_EXTENSIONS = frozenset({'.json'})
+LOG_EXTENSIONS = frozenset({'.json', '.log'})
+
+# The scripts never change directory, so the sandbox root is resolved once at import
+_BASE_DIR = os.path.realpath(os.getcwd())
+
+
+# Read the API token, accepting either SNYK_API_TOKEN or the Snyk CLI's SNYK_TOKEN
+def get_api_token():
+    return os.environ.get('SNYK_API_TOKEN') or os.environ.get('SNYK_TOKEN')
+
+
+# Serialize to UTF-8 JSON bytes, using orjson when it is installed; newline appends a trailing b'\n'
+def dumps_json(value, indent=False, newline=False):
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        if newline:
+            option |= orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(value, option=option)
+    if indent:
+        encoded = json.dumps(value, indent=2, ensure_ascii=False)
+    else:
+        encoded = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    return (encoded + '\n' if newline else encoded).encode('utf-8')
+
+
+# Parse a JSON response body without requests' charset detection
+def loads_json(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+# Resolve a user-supplied path and make sure it stays inside base_dir
+@lru_cache(maxsize=None)
+def resolve_within_base(user_path, base_dir=None, label="Output"):
+    # Anchor relative paths on the cached cwd so realpath never has to call os.getcwd()
+    if not os.path.isabs(user_path):
+        user_path = os.path.join(_BASE_DIR, user_path)
+    # realpath also collapses '..' and symlinks, so neither can be used to escape base_dir
+    abs_user_path = os.path.realpath(user_path)
+    abs_base_dir = _BASE_DIR if base_dir is None else os.path.realpath(base_dir)
+
+    # Compare whole path components so /tmp/foo-bar is not treated as inside /tmp/foo
+    try:
+        common_path = os.path.commonpath([abs_user_path, abs_base_dir])
+    except ValueError:
+        common_path = None
+    if common_path != abs_base_dir:
+        raise ValueError(f"{label} path must be within {abs_base_dir}")
+
+    return abs_user_path
+
+
+# Validate and sanitize input file paths
+def sanitize_input_path(user_path, base_dir=None):
+    abs_user_path = resolve_within_base(user_path, base_dir, label="Input")
+
+    if not os.path.exists(abs_user_path):
+        raise FileNotFoundError(f"File not found: {user_path}")
+
+    if os.path.splitext(abs_user_path)[1].lower() != '.json':
+        raise ValueError("Input file must be a JSON file")
+
+    return abs_user_path
+
+
+# Validate and sanitize output file paths
+def sanitize_output_path(user_path, base_dir=None, extensions=JSON_EXTENSIONS):
+    abs_user_path = resolve_within_base(user_path, base_dir)
+    
+    if os.path.splitext(abs_user_path)[1].lower() not in extensions:
+        raise ValueError(f"Output file must have {' or '.join(sorted(extensions))} extension")
+    
+    return abs_user_path
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry whose exponential backoff gets up to half a second of random jitter.
+
+    Jitter keeps concurrent workers that were throttled together from
+    retrying in lockstep.
+    """
+
+    # Only called right before a retry sleeps, so the first retry (base backoff 0) is jittered too
+    def get_backoff_time(self):
+        return super().get_backoff_time() + random.uniform(0, 0.5)
+
+
+# Backoff before the given 1-based retry, on the same schedule as JitteredRetry
+def retry_backoff(retry_number):
+    backoff = 0 if retry_number <= 1 else RETRY_BACKOFF_FACTOR * 2 ** (retry_number - 1)
+    return min(backoff, RETRY_BACKOFF_MAX) + random.uniform(0, 0.5)
+
+
+# Build a pooled session so repeated requests reuse keep-alive connections;
+# pass retry_statuses=() to retry connection errors only and handle statuses in the caller
+def create_session(api_token, content_type="application/json", pool_maxsize=10,
+                   max_retries=5, retry_methods=("GET",), retry_statuses=RETRY_STATUSES):
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"token {api_token}",
+        "Content-Type": content_type
+    })
+    # Advertise every encoding urllib3 can decode (gzip, deflate, plus br/zstd when installed)
+    session.headers.update(make_headers(accept_encoding=True))
+    # Transparently retry transient failures, honouring Retry-After on 429s
+    retry = JitteredRetry(
+        total=max_retries,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=list(retry_statuses),
+        allowed_methods=frozenset(retry_methods),
+        # Without this urllib3 would still retry a 429/503 carrying Retry-After on its own
+        respect_retry_after_header=bool(retry_statuses),
+        raise_on_status=False
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry))
+    return session
+
+
+# Fetch a single page of organizations
+def fetch_orgs_page(session, url, params):
+    response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+# Work out the page count from the first page, if the API exposes it
+def get_total_pages(response, data, per_page):
+    last_url = response.links.get("last", {}).get("url")
+    if last_url:
+        last_page = parse_qs(urlparse(last_url).query).get("page")
+        if last_page:
+            return int(last_page[0])
+
+    for key in ("total", "totalCount"):
+        total = data.get(key)
+        if isinstance(total, int):
+            return math.ceil(total / per_page)
+
+    return None
+
+
+# Yield the group details, then each organization, from the legacy v1 endpoint
+def iter_orgs_v1(session, group_id):
+    page = 1
+    per_page = 100
+    url = f"{SNYK_API_URL}/v1/group/{group_id}/orgs"
+    params = {
+        "page": page,
+        "perPage": per_page
+    }
+
+    logger.info("Fetching page %d", page)
+    response = fetch_orgs_page(session, url, params)
+    data = loads_json(response.content)
+
+    # Keep only the group fields used downstream rather than the whole first page
+    yield {k: data[k] for k in ("name", "id", "url") if k in data}
+
+    orgs_on_page = data.get('orgs', [])
+    yield from orgs_on_page
+
+    total_pages = get_total_pages(response, data, per_page)
+
+    if total_pages is not None:
+        # Page count is known up front, so fetch the remaining pages concurrently
+        if total_pages > 1:
+            logger.info("Fetching pages 2-%d of %d", total_pages, total_pages)
+            with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
+                responses = executor.map(
+                    lambda p: fetch_orgs_page(session, url, {**params, "page": p}),
+                    range(2, total_pages + 1)
+                )
+                # map() hands pages back in order as soon as each one is ready
+                for response in responses:
+                    yield from loads_json(response.content).get('orgs', [])
+    else:
+        while len(orgs_on_page) >= per_page:
+            page += 1
+            params["page"] = page
+            logger.info("Fetching page %d", page)
+            response = fetch_orgs_page(session, url, params)
+            orgs_on_page = loads_json(response.content).get('orgs', [])
+            yield from orgs_on_page
+
+
+# Yield the group details, then each organization, following the REST links.next cursor
+def iter_orgs_rest(session, group_id):
+    params = {"version": REST_API_VERSION}
+
+    response = session.get(f"{SNYK_API_URL}/rest/groups/{group_id}", params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    group = loads_json(response.content).get('data', {})
+
+    yield {
+        "name": group.get('attributes', {}).get('name'),
+        "id": group.get('id', group_id)
+    }
+
+    url = f"{SNYK_API_URL}/rest/groups/{group_id}/orgs"
+    params = {"version": REST_API_VERSION, "limit": REST_PAGE_LIMIT}
+    page = 1
+
+    while url:
+        logger.info("Fetching page %d", page)
+        response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        data = loads_json(response.content)
+
+        # Flatten JSON:API resources so downstream code can read org['id'] / org['name']
+        for org in data.get('data', []):
+            yield {"id": org.get('id'), **org.get('attributes', {})}
+
+        url = data.get('links', {}).get('next')
+        if url and url.startswith('/'):
+            url = f"{SNYK_API_URL}{url}"
+        # The next link already carries version, limit and cursor
+        params = None
+        page += 1
+
+
+# Yield the Snyk group details first, then every organization in the group
+def iter_snyk_organizations(group_id, api_token, use_v1=False):
+    session = create_session(api_token)
+    try:
+        logger.info("Fetching organizations from group ID: %s", group_id)
+
+        if use_v1:
+            yield from iter_orgs_v1(session, group_id)
+        else:
+            yield from iter_orgs_rest(session, group_id)
+        
+    except requests.exceptions.HTTPError as e:
+        status_code = e.response.status_code
+        if status_code == 401:
+            raise requests.RequestException("Authentication failed. Please check your API token.")
+        elif status_code == 404:
+            raise requests.RequestException(f"Group ID '{group_id}' not found or you don't have access to it.")
+        else:
+            raise requests.RequestException(f"HTTP Error {status_code}: {e}")
+    except requests.exceptions.RequestException as e:
+        raise requests.RequestException(f"Request failed: {e}")
+    finally:
+        session.close()
+
+
+
+# Stream organizations to a JSON file one per line, then append the metadata
+def save_to_json(metadata, group, orgs, validated_output_file):
+    # Write to a side file so a failed fetch never leaves a truncated output behind
+    partial_output_file = f"{validated_output_file}.partial"
+    total_orgs = 0
+    try:
+        with open(partial_output_file, 'wb', buffering=1 << 20) as f:
+            f.write(b'{\n  "organizations": {\n')
+            for key, value in group.items():
+                f.write(b'    ' + dumps_json(key) + b': ' + dumps_json(value) + b',\n')
+
+            f.write(b'    "orgs": [')
+            for org in orgs:
+                f.write(b',\n      ' if total_orgs else b'\n      ')
+                f.write(dumps_json(org))
+                total_orgs += 1
+            f.write(b'\n    ]\n  },\n')
+
+            metadata["total_organizations"] = total_orgs
+            f.write(b'  "metadata": ')
+            f.write(dumps_json(metadata, indent=True).replace(b'\n', b'\n  '))
+            f.write(b'\n}\n')
+
+        os.replace(partial_output_file, validated_output_file)
+        logger.info("Successfully saved organizations data to: %s", validated_output_file)
+        return total_orgs
+    except requests.RequestException:
+        raise
+    except IOError as e:
+        raise IOError(f"Failed to write to file '{validated_output_file}': {e}")
+    finally:
+        if os.path.exists(partial_output_file):
+            os.remove(partial_output_file)
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+
+
+# Parse a Retry-After header given in seconds; HTTP-date values fall back to one second
+def _retry_after_seconds(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class AdaptiveRateLimiter:
+    """Client-side pacing for bursts of API requests shared across threads.
+
+    Concurrency follows AIMD: each response that is not throttled raises the
+    limit by 0.5 up to ``max_concurrency``, while a 429/5xx (or an exhausted
+    ``X-RateLimit-Remaining``) halves it down to ``min_concurrency``. A
+    ``Retry-After`` header pauses every caller until it expires, and
+    ``max_rate`` optionally caps requests per second over a sliding window
+    (fractional rates such as 0.5 widen the window rather than rounding up).
+    ``cancel()`` sets the shared ``cancelled`` event and makes every waiting
+    and future ``acquire()`` give up, so an aborted run stops promptly.
+    """
+
+    def __init__(self, max_concurrency, min_concurrency=1, max_rate=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_rate = max_rate
+        self.limit = float(max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._sent = deque()
+        if max_rate:
+            # Allow `capacity` sends per window so the average is exactly max_rate
+            self._rate_capacity = max(1, int(max_rate))
+            self._rate_window = self._rate_capacity / max_rate
+        self._cond = threading.Condition()
+        self.cancelled = threading.Event()
+
+    # Block until a request may be sent; returns False without a slot once cancelled
+    def acquire(self):
+        with self._cond:
+            while True:
+                if self.cancelled.is_set():
+                    return False
+                now = time.monotonic()
+                wait = self._paused_until - now
+
+                if self.max_rate:
+                    while self._sent and now - self._sent[0] >= self._rate_window:
+                        self._sent.popleft()
+                    if len(self._sent) >= self._rate_capacity:
+                        wait = max(wait, self._rate_window - (now - self._sent[0]))
+
+                if wait <= 0 and self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    if self.max_rate:
+                        self._sent.append(now)
+                    return True
+
+                self._cond.wait(wait if wait > 0 else None)
+
+    # Record the outcome of a request; response is None when it never got one
+    def release(self, response=None):
+        with self._cond:
+            self._in_flight -= 1
+
+            if response is not None:
+                throttled = (
+                    response.status_code == 429
+                    or response.status_code >= 500
+                    or response.headers.get("X-RateLimit-Remaining") == "0"
+                )
+                if throttled:
+                    self.limit = max(self.min_concurrency, self.limit * 0.5)
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after is not None:
+                        resume_at = time.monotonic() + _retry_after_seconds(retry_after)
+                        self._paused_until = max(self._paused_until, resume_at)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 0.5)
+
+            self._cond.notify_all()
+
+    # Wake every waiting caller and stop handing out slots
+    def cancel(self):
+        with self._cond:
+            self.cancelled.set()
+            self._cond.notify_all()